@@ -0,0 +1,268 @@
+"""
+Command line entry point to run scraping jobs defined in a JSON config file.
+
+A config file holds run-wide settings plus a list of jobs; every job inherits the run-wide settings and can
+override any of them:
+
+{
+    "concurrency": 4,
+    "requests_per_second": 2,
+    "max_retries": 3,
+    "max_in_flight_page_mb": 200,
+    "cache_dir": "cache",
+    "max_cache_age_hours": 24,
+    "resume": true,
+    "jobs": [
+        {
+            "name": "italy",
+            "type": "teams_players",
+            "countries": [75],
+            "competitions": ["IT1", "IT2"],
+            "seasons": {"from": "2020/2021", "to": "2023/2024"},
+            "output": "output/italy_players.csv",
+            "scrape_log": "output/italy_scrape_log.csv",
+            "time_budget_minutes": 120,
+            "priority_weights": {"current_season": 3, "tier": 2, "staleness": 1, "cost": 0.5}
+        }
+    ]
+}
+
+Usage: python -m src.cli --config jobs.json [--job italy] [--concurrency 8] [--no-resume] ...
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+from typing import List
+
+import pandas as pd
+
+from src.comps_seasons_teams_players_scraper import (
+    CompetitionsSeasonsTeamsScraper,
+    CompetitionsSeasonsTeamsPlayersScraper,
+)
+from src.scheduler import ScrapeLog, prioritize_work_units
+from src.utils import configure_page_fetching, get_season_names_in_range
+
+TEAMS_JOB = "teams"
+TEAMS_PLAYERS_JOB = "teams_players"
+JOB_TYPES = [TEAMS_JOB, TEAMS_PLAYERS_JOB]
+DEFAULT_JOB_SETTINGS = {
+    "type": TEAMS_JOB,
+    "countries": None,
+    "competitions": None,
+    "seasons": None,
+    "output": None,
+    "concurrency": 1,
+    "requests_per_second": None,
+    "max_retries": 0,
+    "retry_backoff_seconds": 1,
+    "max_in_flight_page_mb": None,
+    "cache_dir": None,
+    "max_cache_age_hours": 24,
+    "resume": False,
+    "checkpoint_every": 100,
+    "scrape_log": None,
+    "time_budget_minutes": None,
+    "priority_weights": None,
+}
+# settings that can't be shared by several jobs, so they can only be overridden for a single job
+SINGLE_JOB_SETTINGS = ["output", "scrape_log"]
+# columns identifying a unit of work that is already in the output of a job, used when resuming
+RESUME_KEYS = {
+    TEAMS_JOB: ["competition_code", "season_name"],
+    TEAMS_PLAYERS_JOB: ["competition_code", "season_name", "team_id"],
+}
+
+
+class JobConfigException(Exception):
+    pass
+
+
+class OutputSink:
+    """
+    Appends scraped data to a csv file (when the path ends with .csv) or to a directory of parquet part files
+    """
+
+    PARTS_PATTERN = "part-*.parquet"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.is_csv = path.endswith(".csv")
+
+    def read(self) -> pd.DataFrame:
+        if self.is_csv:
+            return pd.read_csv(self.path) if os.path.exists(self.path) else pd.DataFrame()
+        parts = sorted(glob.glob(os.path.join(self.path, self.PARTS_PATTERN)))
+        return pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True) if parts else pd.DataFrame()
+
+    def clear(self):
+        """
+        Removes the data written by previous runs
+        """
+        paths = [self.path] if self.is_csv else glob.glob(os.path.join(self.path, self.PARTS_PATTERN))
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write(self, df: pd.DataFrame):
+        if df.empty:
+            return
+        if self.is_csv:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            df.to_csv(self.path, mode="a", header=not os.path.exists(self.path), index=False)
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            n_parts = len(glob.glob(os.path.join(self.path, self.PARTS_PATTERN)))
+            df.to_parquet(os.path.join(self.path, f"part-{n_parts:05d}.parquet"), index=False)
+
+
+def get_season_names(seasons) -> List[str]:
+    # JSON configs naturally hold calendar-year seasons as numbers, e.g. 2023
+    if isinstance(seasons, (str, int)):
+        return [str(seasons)]
+    if isinstance(seasons, dict):
+        return get_season_names_in_range(str(seasons["from"]), str(seasons["to"]))
+    return [str(s_name) for s_name in seasons]
+
+
+def load_jobs(config_path: str, job_names: List[str] = None, overrides: dict = None) -> List[dict]:
+    """
+    Reads the config file and returns the settings of every selected job, with the overrides applied on top
+    """
+    with open(config_path) as f:
+        config = json.load(f)
+    run_settings = {k: v for k, v in config.items() if k != "jobs"}
+    jobs = []
+    for i, job_config in enumerate(config.get("jobs", [])):
+        job = {**DEFAULT_JOB_SETTINGS, "name": f"job_{i}", **run_settings, **job_config, **(overrides or {})}
+        if job_names and job["name"] not in job_names:
+            continue
+        if job["type"] not in JOB_TYPES:
+            raise JobConfigException(f"Job {job['name']} has type {job['type']}, expected one of {JOB_TYPES}.")
+        if not job["seasons"]:
+            raise JobConfigException(f"Job {job['name']} doesn't define any seasons.")
+        if not job["output"]:
+            raise JobConfigException(f"Job {job['name']} doesn't define an output.")
+        if not job["countries"] and not job["competitions"]:
+            raise JobConfigException(f"Job {job['name']} needs at least one country or competition.")
+        job["seasons"] = get_season_names(job["seasons"])
+        jobs.append(job)
+    if job_names and not jobs:
+        raise JobConfigException(f"None of the jobs {job_names} is defined in {config_path}.")
+    single_job_overrides = [k for k in SINGLE_JOB_SETTINGS if k in (overrides or {})]
+    if single_job_overrides and len(jobs) != 1:
+        raise JobConfigException(
+            f"{single_job_overrides} can only be overridden when a single job is selected, got {len(jobs)} jobs."
+        )
+    return jobs
+
+
+def remove_processed_units(df: pd.DataFrame, processed: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    if df.empty or processed.empty:
+        return df
+    processed_units = set(processed[keys].astype(str).itertuples(index=False, name=None))
+    is_processed = df[keys].astype(str).apply(tuple, axis=1).isin(processed_units)
+    return df[~is_processed]
+
+
+def run_job(job: dict):
+    logging.info(f"Running job {job['name']} of type {job['type']}.")
+    configure_page_fetching(
+        requests_per_second=job["requests_per_second"],
+        cache_dir=job["cache_dir"],
+        max_retries=job["max_retries"],
+        retry_backoff_seconds=job["retry_backoff_seconds"],
+        max_in_flight_page_mb=job["max_in_flight_page_mb"],
+        max_cache_age_hours=job["max_cache_age_hours"],
+    )
+    sink = OutputSink(job["output"])
+    if job["resume"]:
+        processed = sink.read()
+    else:
+        # a job that doesn't resume starts over, rather than appending the same rows again to the output
+        sink.clear()
+        processed = pd.DataFrame()
+    teams_scraper = CompetitionsSeasonsTeamsScraper(
+        season_name=job["seasons"],
+        country_id=job["countries"],
+        competition_codes=job["competitions"],
+        max_workers=job["concurrency"],
+    )
+    if job["type"] == TEAMS_JOB:
+        if not processed.empty:
+            teams_scraper.processed_competitions_seasons = set(
+                processed[RESUME_KEYS[TEAMS_JOB]].astype(str).itertuples(index=False, name=None)
+            )
+        # one season at a time so that an interrupted job keeps the seasons already written
+        for s_name in job["seasons"]:
+            teams_scraper.season_name = s_name
+            sink.write(teams_scraper.get_competitions_seasons_teams_data())
+        return
+    deadline = None
+    if job["time_budget_minutes"]:
+        deadline = time.monotonic() + job["time_budget_minutes"] * 60
+    scrape_log = ScrapeLog(job["scrape_log"])
+    competitions_seasons_teams = remove_processed_units(
+        teams_scraper.get_competitions_seasons_teams_data(), processed, RESUME_KEYS[TEAMS_PLAYERS_JOB]
+    )
+    # the units that matter most go first, so they are the ones done if the time budget runs out
+    competitions_seasons_teams = prioritize_work_units(
+        competitions_seasons_teams,
+        competitions=teams_scraper.competitions,
+        scrape_log=scrape_log.read(),
+        weights=job["priority_weights"],
+    )
+    checkpoint_every = job["checkpoint_every"]
+    for start in range(0, competitions_seasons_teams.shape[0], checkpoint_every):
+        if deadline is not None and time.monotonic() > deadline:
+            logging.info(f"Time budget of job {job['name']} exhausted.")
+            break
+        players_scraper = CompetitionsSeasonsTeamsPlayersScraper(
+            competitions_seasons_teams=competitions_seasons_teams.iloc[start:start + checkpoint_every],
+            max_workers=job["concurrency"],
+            deadline=deadline,
+        )
+        players_data = players_scraper.get_competitions_seasons_teams_players_data()
+        sink.write(players_data)
+        scrape_log.record(players_data, scraped_at=players_scraper.pages_fetched_at)
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Scrape competitions, seasons, teams and players.")
+    parser.add_argument("--config", required=True, help="Path to the JSON file defining the jobs.")
+    parser.add_argument("--job", action="append", dest="jobs", help="Name of a job to run. Defaults to all.")
+    parser.add_argument("--concurrency", type=int, help="Number of pages fetched in parallel.")
+    parser.add_argument("--requests-per-second", type=float, help="Max requests per second for the whole run.")
+    parser.add_argument("--max-retries", type=int, help="Retries for a page that couldn't be fetched.")
+    parser.add_argument("--retry-backoff-seconds", type=float, help="Base wait before retrying a failed page.")
+    parser.add_argument("--max-in-flight-page-mb", type=float, help="Memory ceiling for pages parsed at once.")
+    parser.add_argument("--cache-dir", help="Directory where raw pages are cached.")
+    parser.add_argument("--max-cache-age-hours", type=float, help="Download cached pages older than this again.")
+    parser.add_argument("--output", help="Output csv file or parquet directory. Needs a single --job.")
+    parser.add_argument(
+        "--scrape-log", help="Csv file recording when every team was last scraped. Needs a single --job."
+    )
+    parser.add_argument("--time-budget-minutes", type=float, help="Stop starting new teams after this time.")
+    parser.add_argument("--checkpoint-every", type=int, help="Teams scraped between two writes to the output.")
+    parser.add_argument(
+        "--resume", action=argparse.BooleanOptionalAction, help="Skip work already found in the output."
+    )
+    parser.add_argument("--log-level", default="INFO")
+    return parser
+
+
+def main(argv: List[str] = None):
+    args = vars(get_arg_parser().parse_args(argv))
+    logging.basicConfig(level=args.pop("log_level"))
+    config_path = args.pop("config")
+    job_names = args.pop("jobs")
+    overrides = {k: v for k, v in args.items() if v is not None}
+    for job in load_jobs(config_path, job_names, overrides):
+        run_job(job)
+
+
+if __name__ == "__main__":
+    main()
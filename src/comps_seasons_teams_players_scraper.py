@@ -1,18 +1,27 @@
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Union
 from tqdm import tqdm
 
 import pandas as pd
-import urllib.parse
 
 from src.competition_scraper import CompetitionScraper
 from src.utils import (
-    get_souped_page,
-    get_season_name_to_build_a_url,
+    COMPETITION,
+    get_page_fetched_at,
+    open_souped_page,
+    get_season_names_to_build_urls,
+    normalize_links,
+    unquote_names,
+    RESPONSIVE_TABLES,
     TRANSFERMARKT_BASE_URL
 )
 
+# Transfermarkt ignores the name part of its urls, so a competition page can be reached from its code alone
+COMPETITION_URL_FROM_CODE = "/-/startseite/" + COMPETITION + "/{competition_code}"
+
 
 class CompetitionsSeasonsTeamsScraperException(Exception):
     pass
@@ -24,10 +33,29 @@ class CompetitionsSeasonsTeamsScraper:
         season_name: Union[str, List[str]],
         url: str = TRANSFERMARKT_BASE_URL,
         country_id: Union[int, List[int]] = None,
+        competition_codes: List[str] = None,
+        max_workers: int = 1,
     ):
         self.url = url
         self.season_name = season_name
         self.country_id = country_id
+        self.competition_codes = competition_codes
+        self.max_workers = max_workers
+        # (competition_code, season_name) pairs that are skipped, e.g. because they were scraped in a previous run
+        self.processed_competitions_seasons = set()
+        self._competitions = None
+        self._season_names_for_url = {}
+
+    @property
+    def season_name(self):
+        return self._season_name
+
+    @season_name.setter
+    def season_name(self, value):
+        if isinstance(value, str):
+            self._season_name = [value]
+        else:
+            self._season_name = value
 
     @property
     def country_id(self):
@@ -56,9 +84,44 @@ class CompetitionsSeasonsTeamsScraper:
         df["team_id"] = df["team_id"].astype(int)
         return df
 
+    def _map(self, func, items: list) -> list:
+        """
+        Applies func to every item, using a pool of max_workers threads when more than one worker is set
+        """
+        if self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                return list(tqdm(executor.map(func, items), total=len(items)))
+        return [func(item) for item in tqdm(items, total=len(items))]
+
+    @property
+    def competitions(self) -> pd.DataFrame:
+        if self._competitions is None:
+            competitions = self.get_competitions_to_update()
+            if self.competition_codes and not competitions.empty:
+                competitions = competitions[competitions["competition_code"].isin(self.competition_codes)]
+                competitions = competitions.drop_duplicates(subset=["competition_code"])
+            self._competitions = competitions
+        return self._competitions
+
+    def _get_competitions_from_codes(self):
+        competition_scraper = CompetitionScraper()
+        competitions = []
+        for competition_code in self.competition_codes or []:
+            url = TRANSFERMARKT_BASE_URL + COMPETITION_URL_FROM_CODE.format(competition_code=competition_code)
+            try:
+                competitions.append(competition_scraper.get_competition_info_from_competition_url(url=url))
+            except Exception as e:
+                logging.error(f"Error while getting competition info for competition_code {competition_code}: {e}")
+        if not competitions:
+            return pd.DataFrame()
+        return pd.concat(competitions, ignore_index=True)[CompetitionScraper.COLS_IN_ORDER]
+
     def get_competitions_to_update(self):
         competitions_to_update = []
         if self.url == TRANSFERMARKT_BASE_URL:
+            # without countries only the pages of the requested competitions are read, not those of every country
+            if not self.country_id:
+                return self._get_competitions_from_codes()
             countries_df = CompetitionScraper().get_countries_info_from_session_storage()
             countries_df = countries_df[countries_df["country_id"].isin(self.country_id)]
             for ix, row in countries_df.iterrows():
@@ -75,22 +138,21 @@ class CompetitionsSeasonsTeamsScraper:
     def _get_team_names_ids_and_urls(self, souped_page, full_url):
         teams_table = self._get_table_of_interest(souped_page)
         team_names = []
-        team_ids = []
-        team_urls = []
+        team_hrefs = []
         try:
             if teams_table:
                 even = teams_table.select("tbody")[0].find_all("tr", {"class": "even"})
                 odd = teams_table.select("tbody")[0].find_all("tr", {"class": "odd"})
                 for row in odd + even:
-                    team_names.append(row.select("a")[0]["title"])
-                    team_url = row.select("a")[0]["href"].split("/saison_id")[0]
-                    team_urls.append(team_url)
-                    team_ids.append(int(team_url.split("/")[-1]))
+                    team_link = row.select("a")[0]
+                    team_names.append(team_link["title"])
+                    team_hrefs.append(team_link["href"])
+            team_links = normalize_links(team_hrefs)
             return pd.DataFrame(
                 {
                     "team_name": team_names,
-                    "team_id": team_ids,
-                    "team_url": team_urls,
+                    "team_id": team_links["id"].values,
+                    "team_url": team_links["url"].values,
                 }
             )
         except IndexError:
@@ -103,52 +165,62 @@ class CompetitionsSeasonsTeamsScraper:
             logging.error(f"Error while scraping teams for url: {full_url}.\nException: {e}")
             return pd.DataFrame()
 
+    def _get_teams_data_for_competition_season(self, competition_season):
+        row, s_name = competition_season
+        logging.info(f"Processing competition {row['competition_name']} for season {s_name}.")
+        short_url = row["competition_url"]
+        logging.info(f"Processing competition with url: {short_url}")
+        full_url = f"{TRANSFERMARKT_BASE_URL}{short_url}/plus/?saison_id={self._season_names_for_url[s_name]}"
+        try:
+            with open_souped_page(full_url, parse_only=RESPONSIVE_TABLES) as souped_page:
+                teams_data = self._get_team_names_ids_and_urls(souped_page, full_url)
+        except Exception as e:
+            logging.error(f"Error while scraping teams for url: {full_url}.\nException: {e}")
+            return pd.DataFrame()
+        if teams_data.empty:
+            logging.info(
+                f"No data found for competition {row['competition_name']}, season {s_name} "
+                f"and competition_code {row['competition_code']}.\n"
+                f"Url: {full_url}"
+            )
+            return teams_data
+        teams_data["competition_name"] = row["competition_name"]
+        teams_data["competition_code"] = row["competition_code"]
+        teams_data["season_name"] = s_name
+        return teams_data
+
     def get_competitions_seasons_teams_data(self):
         logging.info("Executing get_competitions_seasons_teams_data.")
-        competitions_to_update = self.get_competitions_to_update()
+        competitions_to_update = self.competitions
         if not competitions_to_update.empty:
-            teams_data_for_comps = []
-            for ix, row in competitions_to_update.iterrows():
-                for s_name in self.season_name:
-                    logging.info(f"Processing competition {row['competition_name']} for season {s_name}.")
-                    short_url = row["competition_url"]
-                    logging.info(f"Processing competition with url: {short_url}")
-                    season_name_for_url = get_season_name_to_build_a_url(s_name)
-                    full_url = f"{TRANSFERMARKT_BASE_URL}{short_url}/plus/?saison_id={season_name_for_url}"
-                    souped_page = get_souped_page(full_url)
-                    teams_data = self._get_team_names_ids_and_urls(souped_page, full_url)
-                    if teams_data.empty:
-                        logging.info(
-                            f"No data found for competition {row['competition_name']}, season {s_name} "
-                            f"and competition_code {row['competition_code']}.\n"
-                            f"Url: {full_url}"
-                        )
-                        continue
-                    teams_data["competition_name"] = row["competition_name"]
-                    teams_data["competition_code"] = row["competition_code"]
-                    teams_data["season_name"] = s_name
-                    teams_data_for_comps.append(teams_data)
+            self._season_names_for_url = get_season_names_to_build_urls(self.season_name)
+            competitions_seasons = [
+                (row, s_name)
+                for _, row in competitions_to_update.iterrows()
+                for s_name in self.season_name
+                if (row["competition_code"], s_name) not in self.processed_competitions_seasons
+            ]
+            teams_data_for_comps = [
+                teams_data
+                for teams_data in self._map(self._get_teams_data_for_competition_season, competitions_seasons)
+                if not teams_data.empty
+            ]
             if teams_data_for_comps:
                 return self.convert_id_cols_to_int(pd.concat(teams_data_for_comps))
         return pd.DataFrame()
 
 
-
-
-
-
-
-
-
-
-
-
-
 class CompetitionsSeasonsTeamsPlayersScraper(CompetitionsSeasonsTeamsScraper):
-    def __init__(self, season_name=None, competitions_seasons_teams=None):
-        super().__init__(season_name=season_name)
+    def __init__(
+        self, season_name=None, competitions_seasons_teams=None, max_workers: int = 1, deadline: float = None
+    ):
+        super().__init__(season_name=season_name, max_workers=max_workers)
         self._competitions_seasons_teams = competitions_seasons_teams
         self._player_updater = None
+        # time.monotonic() value after which the remaining teams are skipped
+        self.deadline = deadline
+        # when the page of every (competition_code, season_name, team_id) unit scraped was downloaded
+        self.pages_fetched_at = {}
 
     @property
     def competitions_seasons_teams(self):
@@ -156,44 +228,52 @@ class CompetitionsSeasonsTeamsPlayersScraper(CompetitionsSeasonsTeamsScraper):
             self._competitions_seasons_teams = self.get_competitions_seasons_teams_data()
         return self._competitions_seasons_teams
 
+    def _get_players_data_for_a_team(self, row):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            logging.info(f"Time budget exhausted, skipping team {row['team_name']} for season {row['season_name']}.")
+            return None
+        logging.info(
+            f"Processing team {row['team_name']} for competition {row['competition_name']} "
+            f"and season {row['season_name']}."
+        )
+        player_hrefs = []
+        player_img_alts = []
+        season_name_for_url = self._season_names_for_url[row["season_name"]]
+        full_url = TRANSFERMARKT_BASE_URL + row["team_url"] + f"/plus/1?saison_id={season_name_for_url}"
+        try:
+            # the page tree is freed as soon as the raw hrefs and names are extracted
+            with open_souped_page(full_url, parse_only=RESPONSIVE_TABLES) as souped_page:
+                players_table = self._get_table_of_interest(souped_page, teams=False)
+                if players_table:
+                    odd = players_table.select("tbody")[0].find_all("tr", {"class": "odd"})
+                    even = players_table.select("tbody")[0].find_all("tr", {"class": "even"})
+                    for player_row in odd + even:
+                        inline_tables = player_row.find_all("table", {"class": "inline-table"})
+                        player_img = inline_tables[0].find("a").find("img") or inline_tables[0].find("img")
+                        player_hrefs.append(inline_tables[0].find_all("a")[0]["href"])
+                        player_img_alts.append(player_img["alt"])
+            if not player_hrefs:
+                return None
+            player_links = normalize_links(player_hrefs)
+            players_data = pd.DataFrame({col: [val] * len(player_hrefs) for col, val in row.items()})
+            players_data["player_id"] = player_links["id"].values
+            players_data["player_name"] = unquote_names(player_img_alts).values
+            players_data["player_url"] = player_links["url"].values
+            unit = (row["competition_code"], row["season_name"], row["team_id"])
+            self.pages_fetched_at[unit] = get_page_fetched_at(full_url)
+        except (Exception, IndexError) as e:
+            logging.error(f"Error while scraping player data for player_url: {full_url}.\n" f"Exception: {e}")
+            return None
+        return self.convert_id_cols_to_int(players_data)
+
     def get_competitions_seasons_teams_players_data(self):
         total_cstp_data = []
         if not self.competitions_seasons_teams.empty:
-            for _, row in tqdm(
-                self.competitions_seasons_teams.iterrows(),
-                total=self.competitions_seasons_teams.shape[0],
-            ):
-                logging.info(
-                    f"Processing team {row['team_name']} for competition {row['competition_name']} "
-                    f"and season {row['season_name']}."
-                )
-                cstp_data = []
-                season_name_for_url = get_season_name_to_build_a_url(row["season_name"])
-                full_url = TRANSFERMARKT_BASE_URL + row["team_url"] + f"/plus/1?saison_id={season_name_for_url}"
-                souped_page = get_souped_page(full_url)
-                players_table = self._get_table_of_interest(souped_page, teams=False)
-                try:
-                    if players_table:
-                        odd = players_table.select("tbody")[0].find_all("tr", {"class": "odd"})
-                        even = players_table.select("tbody")[0].find_all("tr", {"class": "even"})
-                        for player_row in tqdm(odd + even, total=len(odd + even)):
-                            inline_tables = player_row.find_all("table", {"class": "inline-table"})
-                            player_url = inline_tables[0].find_all("a")[0]["href"]
-                            player_img = inline_tables[0].find("a").find("img") or inline_tables[0].find("img")
-                            row["player_id"] = int(player_url.rsplit("/", 1)[1])
-                            row["player_name"] = urllib.parse.unquote(player_img["alt"], encoding="utf-8")
-                            row["player_url"] = player_url
-                            cstp_data.append(pd.DataFrame(data=[[val for val in row.values]], columns=list(row.index)))
-                except (Exception, IndexError) as e:
-                    logging.error(f"Error while scraping player data for player_url: {full_url}.\n" f"Exception: {e}")
-                    continue
-                if cstp_data:
-                    cstp_data = self.convert_id_cols_to_int(pd.concat(cstp_data))
-                    total_cstp_data.append(cstp_data)
+            self._season_names_for_url = get_season_names_to_build_urls(self.competitions_seasons_teams["season_name"])
+            teams_rows = [row for _, row in self.competitions_seasons_teams.iterrows()]
+            total_cstp_data = [
+                cstp_data
+                for cstp_data in self._map(self._get_players_data_for_a_team, teams_rows)
+                if cstp_data is not None
+            ]
         return pd.concat(total_cstp_data, ignore_index=True) if total_cstp_data else pd.DataFrame()
-
-
-if __name__ == '__main__':
-    s = CompetitionsSeasonsTeamsScraper(country_id=12, season_name='2023/2024')
-    df = s.get_competitions_seasons_teams_data()
-    print(df)
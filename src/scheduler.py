@@ -0,0 +1,123 @@
+import os
+import re
+from datetime import datetime
+from typing import Dict, Union
+
+import pandas as pd
+
+from src.utils import NO_TIER, YOUTH, get_season_names_to_process_for_a_given_year
+
+DEFAULT_PRIORITY_WEIGHTS = {
+    "current_season": 3.0,
+    "tier": 2.0,
+    "staleness": 1.0,
+    "cost": 0.5,
+}
+# a unit not scraped for this long is as stale as one that was never scraped
+STALENESS_HORIZON_DAYS = 30
+DEFAULT_EXPECTED_N_PLAYERS = 30
+NO_TIER_SCORE = 0.5
+YOUTH_TIER_SCORE = 0.1
+TIER_LEVELS = {"first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5, "sixth": 6, "seventh": 7}
+WORK_UNIT_KEYS = ["competition_code", "season_name", "team_id"]
+SCRAPE_LOG_COLS = WORK_UNIT_KEYS + ["last_scraped", "n_players"]
+# calendar-year season names like 2023 would otherwise be read back from the csv as numbers
+WORK_UNIT_DTYPES = {"competition_code": str, "season_name": str, "team_id": int}
+
+
+def get_tier_score(competition_tier: str) -> float:
+    """
+    Returns 1 for first tier competitions, 1/2 for second tier ones and so on
+    """
+    if not isinstance(competition_tier, str) or competition_tier == NO_TIER:
+        return NO_TIER_SCORE
+    if YOUTH in competition_tier.lower():
+        return YOUTH_TIER_SCORE
+    level = re.match(r"\s*(\w+)", competition_tier.lower())
+    if level and level.group(1) in TIER_LEVELS:
+        return 1 / TIER_LEVELS[level.group(1)]
+    return NO_TIER_SCORE
+
+
+class ScrapeLog:
+    """
+    Csv file recording when every (competition, season, team) unit was last scraped and how many players it had
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+
+    def read(self) -> pd.DataFrame:
+        if not self.path or not os.path.exists(self.path):
+            return pd.DataFrame(columns=SCRAPE_LOG_COLS)
+        log = pd.read_csv(self.path, dtype=WORK_UNIT_DTYPES)
+        # times of pages downloaded and read from the page cache don't all have fractional seconds
+        log["last_scraped"] = pd.to_datetime(log["last_scraped"], format="ISO8601")
+        return log
+
+    def record(self, players_data: pd.DataFrame, scraped_at: Union[datetime, Dict[tuple, datetime]] = None):
+        """
+        scraped_at is either the time of the whole scrape or, by (competition_code, season_name, team_id) unit, the
+        time its page was downloaded, so pages read from the page cache aren't recorded as freshly scraped
+        """
+        if not self.path or players_data.empty:
+            return
+        scraped = players_data.groupby(WORK_UNIT_KEYS).size().reset_index(name="n_players")
+        now = datetime.now()
+        if isinstance(scraped_at, dict):
+            units = scraped[WORK_UNIT_KEYS].itertuples(index=False, name=None)
+            scraped["last_scraped"] = [scraped_at.get(unit, now) for unit in units]
+        else:
+            scraped["last_scraped"] = scraped_at or now
+        log = pd.concat(
+            [self.read().astype(WORK_UNIT_DTYPES), scraped[SCRAPE_LOG_COLS].astype(WORK_UNIT_DTYPES)], ignore_index=True
+        )
+        log = log.drop_duplicates(subset=WORK_UNIT_KEYS, keep="last")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        log.to_csv(self.path, index=False)
+
+
+def prioritize_work_units(
+    competitions_seasons_teams: pd.DataFrame,
+    competitions: pd.DataFrame = None,
+    scrape_log: pd.DataFrame = None,
+    weights: Dict[str, float] = None,
+    now: datetime = None,
+) -> pd.DataFrame:
+    """
+    Sorts the (competition, season, team) units so that the ones that matter most come first.
+
+    A unit's value is a weighted sum of whether its season is the current one, the tier of its competition and
+    the time since it was last scraped. The value is then divided by the expected cost of the unit, estimated
+    from the number of players it had the last time it was scraped, so cheap units are preferred to expensive
+    ones of the same value.
+    """
+    if competitions_seasons_teams.empty:
+        return competitions_seasons_teams
+    weights = {**DEFAULT_PRIORITY_WEIGHTS, **(weights or {})}
+    now = now or datetime.now()
+    units = competitions_seasons_teams.reset_index(drop=True)
+    scores = pd.DataFrame(index=units.index)
+
+    current_seasons = get_season_names_to_process_for_a_given_year(str(now.year), now.month)
+    scores["current_season"] = units["season_name"].isin(current_seasons).astype(float)
+
+    if competitions is not None and not competitions.empty:
+        tiers = competitions.drop_duplicates("competition_code").set_index("competition_code")["competition_tier"]
+        scores["tier"] = units["competition_code"].map(tiers).map(get_tier_score).fillna(NO_TIER_SCORE)
+    else:
+        scores["tier"] = NO_TIER_SCORE
+
+    last_scrapes = pd.DataFrame(columns=SCRAPE_LOG_COLS) if scrape_log is None else scrape_log
+    last_scrapes = units[WORK_UNIT_KEYS].astype(WORK_UNIT_DTYPES).merge(
+        last_scrapes[SCRAPE_LOG_COLS].astype(WORK_UNIT_DTYPES), on=WORK_UNIT_KEYS, how="left"
+    )
+    age_in_days = (now - pd.to_datetime(last_scrapes["last_scraped"])).dt.total_seconds() / (24 * 3600)
+    scores["staleness"] = (age_in_days / STALENESS_HORIZON_DAYS).clip(0, 1).fillna(1).values
+
+    expected_n_players = pd.to_numeric(last_scrapes["n_players"]).fillna(DEFAULT_EXPECTED_N_PLAYERS).values
+    relative_cost = expected_n_players / DEFAULT_EXPECTED_N_PLAYERS
+
+    value = sum(weights[k] * scores[k] for k in ["current_season", "tier", "staleness"])
+    units["priority"] = value / (1 + weights["cost"] * relative_cost)
+    return units.sort_values("priority", ascending=False, kind="stable").drop(columns="priority")
@@ -1,7 +1,16 @@
-from typing import List
+import hashlib
+import os
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, List
 
+import pandas as pd
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from tenacity import Retrying, wait_exponential, retry_if_exception_type, stop_after_attempt
 
 # GENERAL
 TRANSFERMARKT_BASE_URL = 'https://www.transfermarkt.com'
@@ -22,26 +31,225 @@ TIER = "tier"
 YOUTH = "youth"
 DUMMY_ID_VALUE = 0
 DUMMY_NAME_VALUE = ''
+# PAGE PARSING
+# only the tables holding teams and players are parsed from competition and team pages
+RESPONSIVE_TABLES = SoupStrainer("div", {"class": "responsive-table"})
+# a page parsed with RESPONSIVE_TABLES takes up to about 3 times the size of its html in memory (team pages, as
+# measured on tests/test_data), on top of its html that's held until the parsing is done
+PAGE_TREE_MEMORY_FACTOR = 4
+# memory expected for a page before any page was downloaded: a 500KB page, once parsed
+DEFAULT_PAGE_TREE_BYTES = 500 * 2**10 * PAGE_TREE_MEMORY_FACTOR
 
 
-def get_souped_page(url: str) -> BeautifulSoup:
+class PageRequestException(Exception):
+    """Raised when a page could not be fetched but a new attempt might succeed."""
+
+
+class RateLimiter:
     """
-    Takes a url and returns the souped page
+    Spaces out calls to `wait` so that at most `requests_per_second` go through, even across threads
+    """
+
+    def __init__(self, requests_per_second: float = None):
+        self.min_interval = 1 / requests_per_second if requests_per_second else 0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        if not self.min_interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+        time.sleep(max(0.0, slot - now))
+
+
+class PageReservation:
+    def __init__(self, n_bytes: float):
+        self.n_bytes = n_bytes
+
+
+class PageMemoryLimiter:
+    """
+    Throttles the number of pages in flight (downloaded, parsed and being extracted) so that the memory they are
+    expected to take stays under max_bytes. The memory a page takes is only known once downloaded, so every page
+    reserves the average memory of the pages seen so far, and pages go in one at a time until the first one is
+    downloaded. A page is always let in when no other page is in flight, so pages bigger than the ceiling don't
+    block forever.
+    """
+
+    def __init__(self, max_bytes: int = None, expected_page_bytes: int = DEFAULT_PAGE_TREE_BYTES):
+        self.max_bytes = max_bytes
+        self.expected_page_bytes = expected_page_bytes
+        self.bytes_in_flight = 0
+        self.pages_in_flight = 0
+        self.max_pages_in_flight = 0
+        self._n_pages_seen = 0
+        self._condition = threading.Condition()
+
+    def _has_room_for(self, n_bytes: int) -> bool:
+        if self.bytes_in_flight == 0:
+            return True
+        # until a page was downloaded its memory is only a guess, so pages go in one at a time
+        return self._n_pages_seen > 0 and self.bytes_in_flight + n_bytes <= self.max_bytes
+
+    def record_page_size(self, reservation: PageReservation, n_bytes: int):
+        """
+        Replaces the expected memory of a page with the one it takes, once it's downloaded
+        """
+        with self._condition:
+            self._n_pages_seen += 1
+            self.expected_page_bytes += (n_bytes - self.expected_page_bytes) / self._n_pages_seen
+            self.bytes_in_flight += n_bytes - reservation.n_bytes
+            reservation.n_bytes = n_bytes
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self):
+        with self._condition:
+            if self.max_bytes:
+                self._condition.wait_for(lambda: self._has_room_for(self.expected_page_bytes))
+            reservation = PageReservation(self.expected_page_bytes)
+            self.bytes_in_flight += reservation.n_bytes
+            self.pages_in_flight += 1
+            self.max_pages_in_flight = max(self.max_pages_in_flight, self.pages_in_flight)
+        try:
+            yield reservation
+        finally:
+            with self._condition:
+                self.bytes_in_flight -= reservation.n_bytes
+                self.pages_in_flight -= 1
+                self._condition.notify_all()
+
+
+# PAGE FETCHING (see configure_page_fetching)
+_rate_limiter = RateLimiter()
+_page_memory_limiter = PageMemoryLimiter()
+_cache_dir = None
+_max_cache_age_seconds = None
+_max_retries = 0
+_retry_backoff_seconds = 1
+
+
+def configure_page_fetching(
+    requests_per_second: float = None,
+    cache_dir: str = None,
+    max_retries: int = 0,
+    retry_backoff_seconds: float = 1,
+    max_in_flight_page_mb: float = None,
+    max_cache_age_hours: float = None,
+):
+    """
+    Sets how get_souped_page fetches pages for the whole process: a global rate limit, a directory where raw
+    page bodies are cached (and how old a cached page can be before it's downloaded again, never by default),
+    how many times a failed request is retried (with exponential backoff) and the memory ceiling for the pages
+    opened with open_souped_page at the same time.
+    """
+    global _rate_limiter, _page_memory_limiter, _cache_dir, _max_cache_age_seconds, _max_retries, _retry_backoff_seconds
+    _rate_limiter = RateLimiter(requests_per_second)
+    _page_memory_limiter = PageMemoryLimiter(int(max_in_flight_page_mb * 2**20) if max_in_flight_page_mb else None)
+    _cache_dir = cache_dir
+    _max_cache_age_seconds = max_cache_age_hours * 3600 if max_cache_age_hours is not None else None
+    _max_retries = max_retries
+    _retry_backoff_seconds = retry_backoff_seconds
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+def _get_cache_path(url: str) -> str:
+    if not _cache_dir:
+        return None
+    return os.path.join(_cache_dir, f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.html")
+
+
+def _is_fresh_in_cache(cache_path: str) -> bool:
+    if not cache_path or not os.path.exists(cache_path):
+        return False
+    return _max_cache_age_seconds is None or time.time() - os.path.getmtime(cache_path) <= _max_cache_age_seconds
+
+
+def get_page_fetched_at(url: str) -> datetime:
     """
-    resp = requests.get(url, headers=HEADERS)
+    Returns when the page was downloaded, which is when its body was cached for pages read from the page cache
+    """
+    cache_path = _get_cache_path(url)
+    if cache_path and os.path.exists(cache_path):
+        return datetime.fromtimestamp(os.path.getmtime(cache_path))
+    return datetime.now()
+
+
+def _request_page_content(url: str) -> bytes:
+    _rate_limiter.wait()
+    try:
+        resp = requests.get(url, headers=HEADERS)
+    except requests.exceptions.RequestException as e:
+        raise PageRequestException(f"Could not get url: {url}. Exception: {e}")
     if resp.status_code == 200 and resp.url != TRANSFERMARKT_REDIRECT_DEFAULT_PAGE:
-        return BeautifulSoup(resp.content, "lxml")
+        return resp.content
     elif resp.status_code == 200 and resp.url == TRANSFERMARKT_REDIRECT_DEFAULT_PAGE:
         raise Exception(
             f"TransferMarktDisabledPlayerException: {url} was redirected to {resp.url}. "
             f"This is probably because the player is disabled."
         )
     else:
-        raise Exception(
+        raise PageRequestException(
             f"Could not get url: {url}. Status code: {resp.status_code}. " f"Response url:{resp.url}"
         )
 
 
+def get_page_content(url: str) -> bytes:
+    """
+    Takes a url and returns the raw body of the page, reading it from the page cache when it's there and not
+    older than the max cache age
+    """
+    cache_path = _get_cache_path(url)
+    if _is_fresh_in_cache(cache_path):
+        with open(cache_path, "rb") as f:
+            return f.read()
+    retrying = Retrying(
+        retry=retry_if_exception_type(PageRequestException),
+        wait=wait_exponential(multiplier=_retry_backoff_seconds, max=10),
+        stop=stop_after_attempt(_max_retries + 1),
+        reraise=True,
+    )
+    content = retrying(_request_page_content, url)
+    if cache_path:
+        with open(cache_path, "wb") as f:
+            f.write(content)
+    return content
+
+
+def get_souped_page(url: str, parse_only: SoupStrainer = None) -> BeautifulSoup:
+    """
+    Takes a url and returns the souped page
+    """
+    return BeautifulSoup(get_page_content(url), "lxml", parse_only=parse_only)
+
+
+def get_page_memory_limiter() -> PageMemoryLimiter:
+    return _page_memory_limiter
+
+
+@contextmanager
+def open_souped_page(url: str, parse_only: SoupStrainer = None):
+    """
+    Souped page that only lives inside the with block. From its download until the block is left it counts
+    against the memory ceiling for pages in flight, and on exit its tree is decomposed, so extract everything
+    needed from it inside the block.
+    """
+    with _page_memory_limiter.reserve() as reservation:
+        content = get_page_content(url)
+        _page_memory_limiter.record_page_size(reservation, len(content) * PAGE_TREE_MEMORY_FACTOR)
+        souped_page = BeautifulSoup(content, "lxml", parse_only=parse_only)
+        # the raw body is already in the page cache (when there's one), the tree is all that's needed now
+        del content
+        try:
+            yield souped_page
+        finally:
+            souped_page.decompose()
+
+
 def get_season_names_to_process_for_a_given_year(year: str, month: int = None) -> List[str]:
     if month is None:
         return [str(int(year) - 1) + "/" + year, year, year + "/" + str(int(year) + 1)]
@@ -57,3 +265,52 @@ def get_season_name_to_build_a_url(season_name: str) -> str:
     else:
         season_name_for_url = season_name.split("/")[0]
     return season_name_for_url
+
+
+def get_season_names_in_range(first_season_name: str, last_season_name: str) -> List[str]:
+    """
+    Returns every season name between the two given ones (both included), keeping their format: either
+    calendar-year seasons ("2021") or split-year seasons ("2020/2021")
+    """
+    first_is_split = "/" in first_season_name
+    if first_is_split != ("/" in last_season_name):
+        raise ValueError(f"Season names {first_season_name} and {last_season_name} don't share the same format.")
+    first_year = int(first_season_name.split("/")[0])
+    last_year = int(last_season_name.split("/")[0])
+    if first_is_split:
+        return [f"{year}/{year + 1}" for year in range(first_year, last_year + 1)]
+    return [str(year) for year in range(first_year, last_year + 1)]
+
+
+def get_season_names_to_build_urls(season_names: Iterable[str]) -> Dict[str, str]:
+    """
+    Maps every distinct season name to the season name used to build urls, so it's computed once per season
+    """
+    return {s_name: get_season_name_to_build_a_url(s_name) for s_name in set(season_names)}
+
+
+def normalize_links(hrefs: Iterable[str]) -> pd.DataFrame:
+    """
+    Takes raw hrefs like /club-name/startseite/verein/123/saison_id/2022 and returns, for all of them at once,
+    the url without the season part, the trailing id and the saison_id (missing when the href has none)
+    """
+    hrefs = pd.Series(list(hrefs), dtype=object)
+    if hrefs.empty:
+        return pd.DataFrame({"id": pd.Series(dtype=int), "url": hrefs, "saison_id": hrefs})
+    urls = hrefs.str.split("/saison_id", n=1).str[0]
+    return pd.DataFrame(
+        {
+            "id": urls.str.rsplit("/", n=1).str[-1].astype(int),
+            "url": urls,
+            "saison_id": hrefs.str.extract(r"saison_id[/=](\d+)", expand=False),
+        }
+    )
+
+
+def unquote_names(names: Iterable[str]) -> pd.Series:
+    """
+    Url-decodes names, decoding every distinct name only once
+    """
+    names = pd.Series(list(names), dtype=object)
+    unique_names = names.unique()
+    return names.map(dict(zip(unique_names, (urllib.parse.unquote(n, encoding="utf-8") for n in unique_names))))
@@ -0,0 +1,372 @@
+"""
+Local HTTP server replaying Transfermarkt so that whole scraping runs can be load tested offline.
+
+It serves:
+- recorded pages, starting from the zipped pages in tests/test_data, plus any page recorded from an upstream url
+- the countries/competitions session storage, both as a page filling window.sessionStorage and as JSON
+- synthetic competition and team pages, with as many teams and players as needed
+
+Responses can be delayed, throttled and made to fail. ReplayServer.routed() points the scrapers at the server.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+from unittest.mock import PropertyMock, patch
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import requests
+
+from config.paths import TEST_DATA_DIR
+from src.utils import TRANSFERMARKT_BASE_URL
+
+SESSION_STORAGE_PREFIX = "/__session_storage__"
+SYNTHETIC_COMPETITION_PREFIX = "/synthetic-league-"
+SYNTHETIC_TEAM_PREFIX = "/synthetic-team-"
+RECORDINGS_INDEX = "recordings.json"
+# pages of tests/test_data, by the path (and query) they were recorded from
+RECORDED_PAGES = {
+    "/major-league-soccer/startseite/wettbewerb/MLS1/plus/?saison_id=2022": "mls_comp_page",
+    "/major-league-soccer/startseite/wettbewerb/MLS1/plus/?saison_id=2021": "mls_2022_comp_page",
+    "/serie-b/startseite/wettbewerb/IT2/plus/?saison_id=2023": "serie_b_comp_page",
+    "/inter-miami-cf/startseite/verein/69261/plus/1?saison_id=2022": "inter_miami_2023_page",
+    "/pisa-sporting-club/startseite/verein/4172/plus/1?saison_id=2020": "pisa_2020_page",
+    "/i-league/startseite/wettbewerb/IND1": "india_super_league_page",
+    "/hero-super-cup/startseite/pokalwettbewerb/INSC": "india_domestic_cup_page",
+    "/wettbewerbe/national/wettbewerbe/125/plus/?saison_id=2021": "norway_2022_country_page",
+    "/wettbewerbe/national/wettbewerbe/125/plus/?saison_id=2019": "norway_2020_country_page",
+}
+
+
+def get_synthetic_competition_url(competition_code: str) -> str:
+    return f"{SYNTHETIC_COMPETITION_PREFIX}{competition_code.lower()}/startseite/wettbewerb/{competition_code}"
+
+
+def get_synthetic_team_url(team_id: int) -> str:
+    return f"{SYNTHETIC_TEAM_PREFIX}{team_id}/startseite/verein/{team_id}"
+
+
+def build_synthetic_session_storage(n_countries: int, n_competitions_per_country: int) -> dict:
+    """
+    Returns the session storage of the home page (countries) and of every country page (competitions)
+    """
+    countries = [
+        {"id": country_id, "name": f"Country {country_id}", "link": f"/wettbewerbe/national/wettbewerbe/{country_id}"}
+        for country_id in range(1, n_countries + 1)
+    ]
+    session_storage = {"/": {"countries": countries}}
+    for country in countries:
+        session_storage[country["link"]] = {
+            "competitions": [
+                {"link": get_synthetic_competition_url(f"C{country['id']}L{level}")}
+                for level in range(1, n_competitions_per_country + 1)
+            ]
+        }
+    return session_storage
+
+
+class SyntheticPages:
+    """
+    Generates competition pages with n_teams teams and team pages with n_players players. Competition codes
+    are like C1L2 (country 1, second tier) and team ids are unique across competitions.
+    """
+
+    def __init__(self, n_teams: int = 20, n_players: int = 25, padding_bytes: int = 0):
+        self.n_teams = n_teams
+        self.n_players = n_players
+        # rows added to the table of every page, so that pages take as much memory as real ones once parsed (about
+        # 3 times their size). They have no odd/even class, so the scrapers skip them
+        padding_text = "Padding " * 60
+        padding_row = f'<tr><td><a href="/padding/profil/spieler/0" title="{padding_text}">{padding_text}</a></td></tr>'
+        self.padding = padding_row * (padding_bytes // len(padding_row))
+
+    def get_team_ids(self, competition_code: str) -> range:
+        country_id, level = competition_code[1:].split("L")
+        first_id = (int(country_id) * 100 + int(level)) * 1000
+        return range(first_id, first_id + self.n_teams)
+
+    def get_page(self, path: str) -> str:
+        if path.startswith(SYNTHETIC_COMPETITION_PREFIX):
+            return self.get_competition_page(path.split("/wettbewerb/")[1].split("/")[0])
+        if path.startswith(SYNTHETIC_TEAM_PREFIX):
+            return self.get_team_page(int(path.split("/verein/")[1].split("/")[0]))
+        return None
+
+    def get_competition_page(self, competition_code: str) -> str:
+        country_id, level = competition_code[1:].split("L")
+        rows = "".join(
+            f'<tr class="{"odd" if i % 2 == 0 else "even"}"><td>'
+            f'<a href="{get_synthetic_team_url(team_id)}/saison_id/2023" title="Team {team_id}">Team {team_id}</a>'
+            f"</td></tr>"
+            for i, team_id in enumerate(self.get_team_ids(competition_code))
+        )
+        return (
+            f"<html><body>"
+            f"<h1>League {competition_code}</h1>"
+            f'<li class="data-header__label">Number of teams: {self.n_teams}</li>'
+            f'<div class="data-header__club-info"><a href="/wettbewerbe/national/wettbewerbe/{country_id}">'
+            f"Country {country_id}</a>"
+            f'<span class="data-header__label">\nLeague level:\n{self._get_tier_name(int(level))}\n</span></div>'
+            f'<div class="responsive-table"><table><thead><tr><th>Club</th></tr></thead>'
+            f"<tbody>{rows}{self.padding}</tbody></table></div>"
+            f"</body></html>"
+        )
+
+    def get_team_page(self, team_id: int) -> str:
+        rows = "".join(
+            f'<tr class="{"odd" if i % 2 == 0 else "even"}"><td><table class="inline-table"><tr>'
+            f'<td><img alt="Player%20{player_id}"/></td>'
+            f'<td><a href="/player-{player_id}/profil/spieler/{player_id}">Player {player_id}</a></td>'
+            f"</tr></table></td></tr>"
+            for i, player_id in enumerate(range(team_id * 100, team_id * 100 + self.n_players))
+        )
+        return (
+            f"<html><body><h1>Team {team_id}</h1>"
+            f'<div class="responsive-table"><table><thead><tr><th>Player</th></tr></thead>'
+            f"<tbody>{rows}{self.padding}</tbody></table></div>"
+            f"</body></html>"
+        )
+
+    @staticmethod
+    def _get_tier_name(level: int) -> str:
+        return ["First", "Second", "Third", "Fourth", "Fifth"][min(level, 5) - 1] + " Tier"
+
+
+class ReplayServer:
+    """
+    Serves recorded, session storage and synthetic pages on localhost.
+
+    latency: seconds every response is delayed, plus up to latency_jitter more
+    max_requests_per_second: above it requests are answered with a 429
+    failure_rate: share of requests answered with a 500 (seeded, so runs are repeatable)
+    failures_per_path: the first attempts of every path are answered with a 500
+    upstream_url: when set, unknown paths are fetched from it and recorded into recordings_dir, which is required
+    recordings_dir: directory holding the pages recorded from upstream_url, and the index of their paths
+    seed: seed of the latency jitter and of the failures, so runs are repeatable
+    """
+
+    def __init__(
+        self,
+        recorded_pages: dict = None,
+        session_storage: dict = None,
+        synthetic_pages: SyntheticPages = None,
+        latency: float = 0,
+        latency_jitter: float = 0,
+        max_requests_per_second: float = None,
+        failure_rate: float = 0,
+        failures_per_path: int = 0,
+        recordings_dir: str = None,
+        upstream_url: str = None,
+        seed: int = 0,
+    ):
+        if upstream_url and not recordings_dir:
+            raise ValueError("A recordings_dir is needed to record pages from upstream_url.")
+        self.recorded_pages = dict(RECORDED_PAGES if recorded_pages is None else recorded_pages)
+        self.session_storage = session_storage or {}
+        self.synthetic_pages = synthetic_pages or SyntheticPages()
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.max_requests_per_second = max_requests_per_second
+        self.failure_rate = failure_rate
+        self.failures_per_path = failures_per_path
+        self.recordings_dir = recordings_dir
+        self.upstream_url = upstream_url
+        self.stats = Counter()
+        self.requests_per_path = Counter()
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._random = random.Random(seed)
+        self._request_times = []
+        # pages recorded from upstream_url, by path
+        self._recordings = {}
+        self._lock = threading.Lock()
+        # routed() patches requests.get, so the server's own requests go through a session that routed() leaves alone
+        self._session = requests.Session()
+        self._load_recordings_index()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._get_handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._session.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def to_local_url(self, url: str) -> str:
+        return url.replace(TRANSFERMARKT_BASE_URL, self.url, 1)
+
+    @contextmanager
+    def routed(self):
+        """
+        Sends the requests made by the scrapers, and the session storage reads of CompetitionScraper, to the server
+        """
+        def get(url, *args, **kwargs):
+            return self._session.get(self.to_local_url(url), *args, **kwargs)
+
+        with patch("src.utils.requests.get", side_effect=get), patch(
+            "src.competition_scraper.CompetitionScraper.driver",
+            new_callable=PropertyMock,
+            side_effect=lambda: ReplayDriver(self),
+        ):
+            yield self
+
+    def _load_recordings_index(self):
+        if not self.recordings_dir:
+            return
+        index_path = os.path.join(self.recordings_dir, RECORDINGS_INDEX)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self._recordings = json.load(f)
+            self.recorded_pages.update(self._recordings)
+
+    def _record(self, path: str) -> str:
+        resp = self._session.get(f"{self.upstream_url}{path}", headers={"User-Agent": "Mozilla/5.0"})
+        resp.raise_for_status()
+        file_name = f"recorded_{hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]}"
+        with ZipFile(os.path.join(self.recordings_dir, f"{file_name}.html.zip"), "w", ZIP_DEFLATED) as zf:
+            zf.writestr(f"{file_name}.html", resp.text)
+        with self._lock:
+            self.recorded_pages[path] = file_name
+            self._recordings[path] = file_name
+            with open(os.path.join(self.recordings_dir, RECORDINGS_INDEX), "w") as f:
+                json.dump(self._recordings, f, indent=2, sort_keys=True)
+        return resp.text
+
+    def _read_recorded_page(self, path: str) -> str:
+        file_name = self.recorded_pages[path]
+        # pages recorded from upstream_url live in recordings_dir, the rest are the pages of tests/test_data
+        pages_dir = self.recordings_dir if path in self._recordings else TEST_DATA_DIR
+        with ZipFile(os.path.join(pages_dir, f"{file_name}.html.zip")) as zf:
+            return zf.read(f"{file_name}.html").decode("utf-8")
+
+    def _get_injected_status(self, path: str) -> int:
+        with self._lock:
+            self.requests_per_path[path] += 1
+            now = time.monotonic()
+            if self.max_requests_per_second:
+                self._request_times = [t for t in self._request_times if now - t < 1] + [now]
+                if len(self._request_times) > self.max_requests_per_second:
+                    return 429
+            if self.requests_per_path[path] <= self.failures_per_path:
+                return 500
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                return 500
+        return None
+
+    def _get_response(self, path: str) -> Tuple[int, str, str]:
+        # the session storage read by ReplayDriver stands for the browser, so no failures are injected into it
+        if path.startswith(SESSION_STORAGE_PREFIX):
+            storage_path = path[len(SESSION_STORAGE_PREFIX):] or "/"
+            if storage_path not in self.session_storage:
+                return 404, "text/plain", "Not found"
+            return 200, "application/json", json.dumps(self.session_storage[storage_path])
+        status = self._get_injected_status(path)
+        if status:
+            return status, "text/plain", f"Injected {status}"
+        if path in self.session_storage:
+            return 200, "text/html", self._get_session_storage_page(self.session_storage[path])
+        if path in self.recorded_pages:
+            return 200, "text/html", self._read_recorded_page(path)
+        synthetic_page = self.synthetic_pages.get_page(path)
+        if synthetic_page is not None:
+            return 200, "text/html", synthetic_page
+        if self.upstream_url:
+            return 200, "text/html", self._record(path)
+        return 404, "text/plain", "Not found"
+
+    @staticmethod
+    def _get_session_storage_page(storage: dict) -> str:
+        items = "".join(
+            f"window.sessionStorage.setItem({json.dumps(key)}, {json.dumps(json.dumps(value))});"
+            for key, value in storage.items()
+        )
+        return f"<html><head><script>{items}</script></head><body></body></html>"
+
+    def _get_handler_class(self):
+        replay_server = self
+
+        class ReplayRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with replay_server._lock:
+                    replay_server._in_flight += 1
+                    replay_server.max_in_flight = max(replay_server.max_in_flight, replay_server._in_flight)
+                try:
+                    if replay_server.latency or replay_server.latency_jitter:
+                        with replay_server._lock:
+                            jitter = replay_server._random.uniform(0, replay_server.latency_jitter)
+                        time.sleep(replay_server.latency + jitter)
+                    status, content_type, body = replay_server._get_response(self.path)
+                    body = body.encode("utf-8")
+                    with replay_server._lock:
+                        replay_server.stats[status] += 1
+                        replay_server.stats["bytes_sent"] += len(body)
+                    self.send_response(status)
+                    self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with replay_server._lock:
+                        replay_server._in_flight -= 1
+
+            def log_message(self, format, *args):
+                pass
+
+        return ReplayRequestHandler
+
+
+class ReplayDriver:
+    """
+    Stands in for the headless Chrome of CompetitionScraper, answering its session storage scripts with the
+    session storage served by a ReplayServer
+    """
+
+    def __init__(self, replay_server: ReplayServer):
+        self.replay_server = replay_server
+        self._storage = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def get(self, url: str):
+        path = urllib.parse.urlparse(self.replay_server.to_local_url(url)).path or "/"
+        resp = self.replay_server._session.get(f"{self.replay_server.url}{SESSION_STORAGE_PREFIX}{path}")
+        storage = resp.json() if resp.status_code == 200 else {}
+        self._storage = {key: json.dumps(value) for key, value in storage.items()}
+
+    def execute_script(self, script: str):
+        keys = list(self._storage)
+        if "sessionStorage.length" in script:
+            return len(keys)
+        if "sessionStorage.key(" in script:
+            i = int(script.split("key(")[1].split(")")[0])
+            return keys[i] if i < len(keys) else None
+        if "sessionStorage.getItem(" in script:
+            return self._storage.get(script.split("getItem('")[1].split("')")[0])
+        raise ValueError(f"Unsupported script: {script}")
@@ -0,0 +1,207 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+import requests_mock
+
+from src.cli import DEFAULT_JOB_SETTINGS, JobConfigException, OutputSink, load_jobs, remove_processed_units, run_job
+from src.utils import TRANSFERMARKT_BASE_URL, configure_page_fetching, get_season_names_in_range
+import tests.test_comps_seasons_teams_players_scraper as cstp_tests
+from tests.test_utils import get_html_text_from_a_test_data_zip_file
+
+
+class TestLoadJobs(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config_path = os.path.join(self.tmp_dir.name, "jobs.json")
+        self.config = {
+            "concurrency": 4,
+            "cache_dir": "cache",
+            "jobs": [
+                {
+                    "name": "italy",
+                    "type": "teams_players",
+                    "countries": [75],
+                    "seasons": {"from": "2020/2021", "to": "2022/2023"},
+                    "output": "italy.csv",
+                },
+                {"name": "mls", "competitions": ["MLS1"], "seasons": "2023", "output": "mls", "concurrency": 2},
+            ],
+        }
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _write_config(self):
+        with open(self.config_path, "w") as f:
+            json.dump(self.config, f)
+
+    def test_load_jobs_merges_run_settings_job_settings_and_overrides(self):
+        self._write_config()
+        italy, mls = load_jobs(self.config_path, overrides={"resume": True})
+
+        self.assertEqual(["2020/2021", "2021/2022", "2022/2023"], italy["seasons"])
+        self.assertEqual(4, italy["concurrency"])
+        self.assertEqual(2, mls["concurrency"])
+        self.assertEqual("teams", mls["type"])
+        self.assertEqual(["2023"], mls["seasons"])
+        self.assertTrue(italy["resume"] and mls["resume"])
+        self.assertEqual("cache", mls["cache_dir"])
+
+    def test_load_jobs_converts_numeric_seasons_to_season_names(self):
+        self.config["jobs"][0]["seasons"] = {"from": 2021, "to": 2022}
+        self.config["jobs"][1]["seasons"] = 2023
+        self._write_config()
+        italy, mls = load_jobs(self.config_path)
+
+        self.assertEqual(["2021", "2022"], italy["seasons"])
+        self.assertEqual(["2023"], mls["seasons"])
+
+    def test_load_jobs_returns_only_the_selected_jobs(self):
+        self._write_config()
+        jobs = load_jobs(self.config_path, job_names=["mls"])
+        self.assertEqual(["mls"], [job["name"] for job in jobs])
+        with self.assertRaises(JobConfigException):
+            load_jobs(self.config_path, job_names=["spain"])
+
+    def test_load_jobs_only_overrides_the_output_and_scrape_log_of_a_single_job(self):
+        self._write_config()
+        for overrides in [{"output": "players.csv"}, {"scrape_log": "scrape_log.csv"}]:
+            with self.assertRaises(JobConfigException):
+                load_jobs(self.config_path, overrides=overrides)
+            (mls,) = load_jobs(self.config_path, job_names=["mls"], overrides=overrides)
+            self.assertEqual(list(overrides.values())[0], mls[list(overrides)[0]])
+
+    def test_load_jobs_raises_when_a_job_is_not_valid(self):
+        self.config["jobs"][1]["type"] = "players"
+        self._write_config()
+        with self.assertRaises(JobConfigException):
+            load_jobs(self.config_path)
+
+    def test_get_season_names_in_range_keeps_the_season_format(self):
+        self.assertEqual(["2021", "2022", "2023"], get_season_names_in_range("2021", "2023"))
+        self.assertEqual(["2022/2023", "2023/2024"], get_season_names_in_range("2022/2023", "2023/2024"))
+        with self.assertRaises(ValueError):
+            get_season_names_in_range("2022", "2023/2024")
+
+
+class TestOutputSink(unittest.TestCase):
+    DF = pd.DataFrame({"competition_code": ["MLS1", "IT2"], "season_name": ["2023", "2020/2021"]})
+
+    def test_output_sink_appends_to_csv_and_parquet_outputs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for path in [os.path.join(tmp_dir, "out.csv"), os.path.join(tmp_dir, "out")]:
+                sink = OutputSink(path)
+                pd.testing.assert_frame_equal(pd.DataFrame(), sink.read())
+                sink.write(self.DF)
+                sink.write(pd.DataFrame())
+                sink.write(self.DF)
+                pd.testing.assert_frame_equal(pd.concat([self.DF, self.DF], ignore_index=True), sink.read())
+                sink.clear()
+                pd.testing.assert_frame_equal(pd.DataFrame(), sink.read())
+
+    def test_remove_processed_units_drops_the_units_found_in_the_output(self):
+        processed = pd.DataFrame({"competition_code": ["MLS1"], "season_name": ["2023"], "team_id": [1]})
+        df = remove_processed_units(self.DF, processed, ["competition_code", "season_name"])
+        self.assertEqual(["IT2"], list(df["competition_code"]))
+
+
+class TestRunJob(unittest.TestCase):
+    C_S_T_DF = cstp_tests.TestCompetitionsSeasonsTeamPlayersScraper.C_S_T_DF
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.job = {
+            **DEFAULT_JOB_SETTINGS,
+            "name": "players",
+            "type": "teams_players",
+            "countries": [184],
+            "competitions": None,
+            "seasons": ["2023"],
+            "output": os.path.join(self.tmp_dir.name, "players.csv"),
+            "concurrency": 2,
+            "cache_dir": os.path.join(self.tmp_dir.name, "cache"),
+            "resume": True,
+            "checkpoint_every": 1,
+        }
+
+    def tearDown(self) -> None:
+        configure_page_fetching()
+        self.tmp_dir.cleanup()
+
+    @patch("src.comps_seasons_teams_players_scraper.CompetitionsSeasonsTeamsScraper.get_competitions_to_update")
+    @patch(
+        "src.comps_seasons_teams_players_scraper.CompetitionsSeasonsTeamsScraper.get_competitions_seasons_teams_data"
+    )
+    def test_run_job_resumes_from_the_teams_already_in_the_output(self, c_s_t_mock, competitions_mock):
+        c_s_t_mock.return_value = self.C_S_T_DF
+        competitions_mock.return_value = pd.DataFrame()
+        with requests_mock.Mocker() as m:
+            m.get(
+                f"{TRANSFERMARKT_BASE_URL}/inter-miami-cf/startseite/verein/69261/plus/1?saison_id=2022",
+                text=get_html_text_from_a_test_data_zip_file("inter_miami_2023_page"),
+            )
+            m.get(
+                f"{TRANSFERMARKT_BASE_URL}/pisa-sporting-club/startseite/verein/4172/plus/1?saison_id=2020",
+                status_code=500,
+            )
+            run_job(self.job)
+            players_after_first_run = OutputSink(self.job["output"]).read()
+            m.get(
+                f"{TRANSFERMARKT_BASE_URL}/pisa-sporting-club/startseite/verein/4172/plus/1?saison_id=2020",
+                text=get_html_text_from_a_test_data_zip_file("pisa_2020_page"),
+            )
+            run_job(self.job)
+            players_after_second_run = OutputSink(self.job["output"]).read()
+            n_requests = m.call_count
+
+        self.assertEqual({69261}, set(players_after_first_run["team_id"]))
+        self.assertEqual(31 + 35, players_after_second_run.shape[0])
+        # Inter Miami isn't requested again on the second run
+        self.assertEqual(3, n_requests)
+
+    @patch("src.competition_scraper.CompetitionScraper.get_countries_info_from_session_storage")
+    def test_run_job_scrapes_the_competitions_of_a_job_without_countries(self, countries_df_mock):
+        job = {**self.job, "type": "teams", "countries": None, "competitions": ["MLS1"]}
+        with requests_mock.Mocker() as m:
+            m.get(
+                f"{TRANSFERMARKT_BASE_URL}/-/startseite/wettbewerb/MLS1",
+                text=get_html_text_from_a_test_data_zip_file("mls_comp_page"),
+            )
+            m.get(
+                f"{TRANSFERMARKT_BASE_URL}/-/startseite/wettbewerb/MLS1/plus/?saison_id=2022",
+                text=get_html_text_from_a_test_data_zip_file("mls_comp_page"),
+            )
+            run_job(job)
+            n_requests = m.call_count
+        teams_data = OutputSink(job["output"]).read()
+
+        self.assertEqual(29, teams_data.shape[0])
+        self.assertEqual({"MLS1"}, set(teams_data["competition_code"]))
+        # the competition is looked up from its code, without going through the countries
+        self.assertEqual(2, n_requests)
+        countries_df_mock.assert_not_called()
+
+    @patch("src.comps_seasons_teams_players_scraper.CompetitionsSeasonsTeamsScraper.get_competitions_to_update")
+    @patch(
+        "src.comps_seasons_teams_players_scraper.CompetitionsSeasonsTeamsScraper.get_competitions_seasons_teams_data"
+    )
+    def test_run_job_replaces_the_output_when_not_resuming(self, c_s_t_mock, competitions_mock):
+        c_s_t_mock.return_value = self.C_S_T_DF.iloc[:1]
+        competitions_mock.return_value = pd.DataFrame()
+        job = {**self.job, "resume": False}
+        with requests_mock.Mocker() as m:
+            m.get(
+                f"{TRANSFERMARKT_BASE_URL}/inter-miami-cf/startseite/verein/69261/plus/1?saison_id=2022",
+                text=get_html_text_from_a_test_data_zip_file("inter_miami_2023_page"),
+            )
+            run_job(job)
+            run_job(job)
+
+        self.assertEqual(31, OutputSink(job["output"]).read().shape[0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -88,6 +88,30 @@ class TestCompetitionsSeasonsTeamsScraper(unittest.TestCase):
         self.assertEqual(expected_df_shape, teams_df.shape)
         self.assertCountEqual(expected_cols, list(teams_df.columns))
 
+    @patch('src.comps_seasons_teams_players_scraper.CompetitionsSeasonsTeamsScraper.get_competitions_to_update')
+    def test_get_competitions_seasons_teams_data_skips_the_competition_seasons_whose_page_fails(self, get_comp_mock):
+        get_comp_mock.return_value = pd.DataFrame(
+            {
+                'competition_name': ['Major League Soccer'],
+                'competition_code': ['MLS1'],
+                'competition_url': ['/major-league-soccer/startseite/wettbewerb/MLS1'],
+            }
+        )
+        obj = CompetitionsSeasonsTeamsScraper(season_name=["2022", "2023"], max_workers=2)
+        with requests_mock.Mocker() as m:
+            m.get(
+                "https://www.transfermarkt.com/major-league-soccer/startseite/wettbewerb/MLS1/plus/?saison_id=2022",
+                text=self.html_mls,
+            )
+            m.get(
+                "https://www.transfermarkt.com/major-league-soccer/startseite/wettbewerb/MLS1/plus/?saison_id=2021",
+                status_code=500,
+            )
+            teams_df = obj.get_competitions_seasons_teams_data()
+
+        self.assertEqual({"2023"}, set(teams_df["season_name"]))
+        self.assertEqual(29, teams_df.shape[0])
+
     @patch('src.comps_seasons_teams_players_scraper.CompetitionsSeasonsTeamsScraper.get_competitions_to_update')
     def test_get_competitions_seasons_teams_data_returns_empty_data_frame_when_competitions_to_update_is_empty(
             self, get_comp_mock
@@ -166,6 +190,15 @@ class TestCompetitionsSeasonsTeamPlayersScraper(unittest.TestCase):
         players_data = obj.get_competitions_seasons_teams_players_data()
         pd.testing.assert_frame_equal(pd.DataFrame(), players_data)
 
+    def test_get_competitions_seasons_teams_players_data_skips_teams_once_the_deadline_is_reached(self):
+        obj = CompetitionsSeasonsTeamsPlayersScraper(competitions_seasons_teams=self.C_S_T_DF, deadline=0)
+        with requests_mock.Mocker() as m:
+            players_data = obj.get_competitions_seasons_teams_players_data()
+            n_requests = m.call_count
+
+        self.assertEqual(0, n_requests)
+        pd.testing.assert_frame_equal(pd.DataFrame(), players_data)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,195 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import requests
+import requests_mock
+
+import tests.test_comps_seasons_teams_players_scraper as cstp_tests
+from config.paths import BASE_DIR
+from src.cli import DEFAULT_JOB_SETTINGS, OutputSink, run_job
+from src.comps_seasons_teams_players_scraper import CompetitionsSeasonsTeamsPlayersScraper
+from src.utils import PAGE_TREE_MEMORY_FACTOR, TRANSFERMARKT_BASE_URL, configure_page_fetching
+from tests.replay_server import ReplayServer, SyntheticPages, build_synthetic_session_storage
+from tests.test_utils import get_html_text_from_a_test_data_zip_file
+
+
+class TestReplayServer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.job = {
+            **DEFAULT_JOB_SETTINGS,
+            "name": "load_test",
+            "type": "teams_players",
+            "countries": [1, 2],
+            "seasons": ["2022", "2023"],
+            "output": os.path.join(self.tmp_dir.name, "players"),
+            "concurrency": 8,
+            "max_retries": 3,
+            "retry_backoff_seconds": 0.01,
+            "checkpoint_every": 20,
+        }
+
+    def tearDown(self) -> None:
+        configure_page_fetching()
+        self.tmp_dir.cleanup()
+
+    def test_replay_server_serves_the_recorded_pages(self):
+        with ReplayServer() as server, server.routed():
+            obj = CompetitionsSeasonsTeamsPlayersScraper(
+                competitions_seasons_teams=cstp_tests.TestCompetitionsSeasonsTeamPlayersScraper.C_S_T_DF
+            )
+            players_data = obj.get_competitions_seasons_teams_players_data()
+
+        self.assertEqual(31 + 35, players_data.shape[0])
+        self.assertEqual(2, server.stats[200])
+
+    def test_replay_server_serves_the_session_storage_as_a_page_and_as_json(self):
+        session_storage = build_synthetic_session_storage(n_countries=1, n_competitions_per_country=1)
+        with ReplayServer(session_storage=session_storage) as server:
+            page = requests.get(f"{server.url}/").text
+            storage = requests.get(f"{server.url}/__session_storage__/wettbewerbe/national/wettbewerbe/1").json()
+
+        self.assertIn("window.sessionStorage.setItem(\"countries\"", page)
+        self.assertEqual(["competitions"], list(storage))
+
+    def test_full_run_under_latency_and_failures_scrapes_every_player(self):
+        n_countries, n_competitions, n_teams, n_players = 2, 2, 10, 15
+        server = ReplayServer(
+            session_storage=build_synthetic_session_storage(n_countries, n_competitions),
+            synthetic_pages=SyntheticPages(n_teams=n_teams, n_players=n_players),
+            latency=0.02,
+            failures_per_path=1,
+        )
+        with server, server.routed():
+            start = time.monotonic()
+            run_job(self.job)
+            elapsed = time.monotonic() - start
+        players_data = OutputSink(self.job["output"]).read()
+
+        self.assertEqual(n_countries * n_competitions * 2 * n_teams * n_players, players_data.shape[0])
+        # every page failed once and was retried
+        self.assertEqual(len(server.requests_per_path), server.stats[500])
+        self.assertEqual({2}, set(server.requests_per_path.values()))
+        # pages were fetched concurrently: a sequential run would take at least latency * number of requests
+        self.assertGreater(server.max_in_flight, 1)
+        self.assertLess(elapsed, 0.02 * sum(server.requests_per_path.values()))
+
+    def test_rate_limit_keeps_the_run_under_the_server_throttling(self):
+        server = ReplayServer(
+            session_storage=build_synthetic_session_storage(n_countries=1, n_competitions_per_country=1),
+            synthetic_pages=SyntheticPages(n_teams=10, n_players=5),
+            max_requests_per_second=20,
+        )
+        with server, server.routed():
+            run_job({**self.job, "countries": [1], "seasons": ["2023"], "requests_per_second": 15})
+        players_data = OutputSink(self.job["output"]).read()
+
+        self.assertEqual(0, server.stats[429])
+        self.assertEqual(10 * 5, players_data.shape[0])
+
+    def test_replay_server_records_unknown_pages_from_upstream_and_replays_them(self):
+        path = "/pisa-sporting-club/startseite/verein/4172/plus/1?saison_id=2020"
+        with ReplayServer() as upstream:
+            with ReplayServer(recorded_pages={}, recordings_dir=self.tmp_dir.name, upstream_url=upstream.url) as server:
+                recorded_page = requests.get(f"{server.url}{path}").text
+        with ReplayServer(recorded_pages={}, recordings_dir=self.tmp_dir.name) as server:
+            replayed_page = requests.get(f"{server.url}{path}").text
+
+        self.assertEqual(1, upstream.stats[200])
+        self.assertIn("Pisa", replayed_page)
+        self.assertEqual(recorded_page, replayed_page)
+
+    def test_replay_server_records_pages_from_transfermarkt_while_routing_the_scrapers(self):
+        path = "/pisa-sporting-club/startseite/verein/4172/plus/1?saison_id=2020"
+        server = ReplayServer(recorded_pages={}, recordings_dir=self.tmp_dir.name, upstream_url=TRANSFERMARKT_BASE_URL)
+        # transfermarkt is mocked, the requests to the server go through
+        with requests_mock.Mocker(real_http=True) as m, server, server.routed():
+            upstream = m.get(
+                f"{TRANSFERMARKT_BASE_URL}{path}", text=get_html_text_from_a_test_data_zip_file("pisa_2020_page")
+            )
+            # the recording must not be routed back to the server itself
+            page = requests.get(f"{TRANSFERMARKT_BASE_URL}{path}", timeout=5).text
+
+        self.assertEqual(1, upstream.call_count)
+        self.assertEqual(1, sum(server.requests_per_path.values()))
+        self.assertIn("Pisa", page)
+        with open(os.path.join(self.tmp_dir.name, "recordings.json")) as f:
+            self.assertEqual([path], list(json.load(f)))
+
+    def test_replay_server_needs_a_recordings_dir_to_record_pages(self):
+        with self.assertRaises(ValueError):
+            ReplayServer(upstream_url="https://www.transfermarkt.com")
+
+
+# runs the teams with small pages, to reach the memory the run takes regardless of page sizes, then with big pages
+# under the ceiling and finally with big pages and no ceiling, printing the peak RSS after each run. The pages are
+# padded with table rows, which are kept in the parsed tree like the players of real pages
+PEAK_RSS_SCRIPT = """
+import json, logging, resource, sys
+import pandas as pd
+from src.comps_seasons_teams_players_scraper import CompetitionsSeasonsTeamsPlayersScraper
+from src.utils import configure_page_fetching, get_page_memory_limiter
+from tests.replay_server import ReplayServer, SyntheticPages, get_synthetic_team_url
+
+logging.disable(logging.CRITICAL)
+n_teams, padding_bytes, max_workers = int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[4])
+max_in_flight_page_mb = float(sys.argv[3])
+c_s_t_df = pd.DataFrame(
+    {
+        "competition_name": "Synthetic League",
+        "competition_code": "C1L1",
+        "season_name": "2023",
+        "team_id": range(n_teams),
+        "team_name": [f"Team {i}" for i in range(n_teams)],
+        "team_url": [get_synthetic_team_url(i) for i in range(n_teams)],
+    }
+)
+peak_rss_mb, max_pages_in_flight = [], []
+for page_padding_bytes, ceiling in [(0, None), (padding_bytes, max_in_flight_page_mb), (padding_bytes, None)]:
+    configure_page_fetching(max_in_flight_page_mb=ceiling)
+    pages = SyntheticPages(n_players=10, padding_bytes=page_padding_bytes)
+    with ReplayServer(synthetic_pages=pages, latency=0.01) as server, server.routed():
+        obj = CompetitionsSeasonsTeamsPlayersScraper(competitions_seasons_teams=c_s_t_df, max_workers=max_workers)
+        n_players = obj.get_competitions_seasons_teams_players_data().shape[0]
+    peak_rss_mb.append(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+    max_pages_in_flight.append(get_page_memory_limiter().max_pages_in_flight)
+print(json.dumps({"n_players": n_players, "peak_rss_mb": peak_rss_mb, "max_pages_in_flight": max_pages_in_flight}))
+"""
+
+
+class TestPageMemory(unittest.TestCase):
+    @unittest.skipUnless(os.environ.get("RUN_LOAD_TESTS"), "takes about a minute, set RUN_LOAD_TESTS=1 to run it")
+    @unittest.skipUnless(sys.platform.startswith("linux"), "ru_maxrss is in kilobytes only on linux")
+    def test_in_flight_pages_ceiling_bounds_the_pages_parsed_at_once_and_the_peak_rss(self):
+        # a 2MB page is expected to take 8MB from its download until its tree is freed, so the 20MB ceiling lets two
+        # pages in at a time. The replay server runs in the same process and the download buffers of requests come
+        # on top of the pages, so the peak RSS isn't compared to the ceiling itself but to a run without ceiling.
+        n_teams, padding_bytes, max_in_flight_page_mb, max_workers = 100, 2 * 2**20, 20, 64
+        # one malloc arena per thread would keep the memory freed by every thread, whatever the ceiling
+        env = {**os.environ, "PYTHONPATH": BASE_DIR, "MALLOC_ARENA_MAX": "2"}
+        args = [n_teams, padding_bytes, max_in_flight_page_mb, max_workers]
+        output = subprocess.run(
+            [sys.executable, "-c", PEAK_RSS_SCRIPT, *map(str, args)],
+            cwd=BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        baseline_peak_rss_mb, peak_rss_mb, no_ceiling_peak_rss_mb = result["peak_rss_mb"]
+        expected_page_mb = padding_bytes * PAGE_TREE_MEMORY_FACTOR / 2**20
+
+        self.assertEqual(n_teams * 10, result["n_players"])
+        self.assertLessEqual(result["max_pages_in_flight"][1], max_in_flight_page_mb // expected_page_mb)
+        self.assertGreater(result["max_pages_in_flight"][2], max_workers // 2)
+        self.assertLess(peak_rss_mb - baseline_peak_rss_mb, (no_ceiling_peak_rss_mb - baseline_peak_rss_mb) / 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from src.scheduler import ScrapeLog, get_tier_score, prioritize_work_units
+
+
+class TestScheduler(unittest.TestCase):
+    NOW = datetime(2023, 10, 1)
+    UNITS = pd.DataFrame(
+        {
+            "competition_name": ["Serie B", "Serie A", "Serie A", "Primavera 1"],
+            "competition_code": ["IT2", "IT1", "IT1", "IJ1"],
+            "season_name": ["2023/2024", "2020/2021", "2023/2024", "2023/2024"],
+            "team_id": [4172, 46, 46, 10321],
+            "team_name": ["Pisa", "Inter", "Inter", "Inter U19"],
+            "team_url": ["/pisa/startseite/verein/4172", "/inter/startseite/verein/46", "/inter/startseite/verein/46",
+                         "/inter-u19/startseite/verein/10321"],
+        }
+    )
+    COMPETITIONS = pd.DataFrame(
+        {
+            "competition_code": ["IT1", "IT2", "IJ1"],
+            "competition_tier": ["First Tier", "Second Tier", "Youth league"],
+        }
+    )
+
+    def test_get_tier_score_ranks_top_tiers_first(self):
+        self.assertEqual(1, get_tier_score("First Tier"))
+        self.assertEqual(0.5, get_tier_score("Second Tier"))
+        self.assertLess(get_tier_score("Youth league"), get_tier_score("Fifth Tier"))
+        self.assertEqual(get_tier_score("Not Available"), get_tier_score(None))
+
+    def test_prioritize_work_units_puts_current_season_and_top_tier_first(self):
+        units = prioritize_work_units(self.UNITS, competitions=self.COMPETITIONS, now=self.NOW)
+        self.assertEqual(
+            [("IT1", "2023/2024"), ("IT2", "2023/2024"), ("IJ1", "2023/2024"), ("IT1", "2020/2021")],
+            list(zip(units["competition_code"], units["season_name"])),
+        )
+        self.assertCountEqual(list(self.UNITS.columns), list(units.columns))
+
+    def test_prioritize_work_units_puts_recently_scraped_units_last(self):
+        scrape_log = pd.DataFrame(
+            {
+                "competition_code": ["IT1", "IT2"],
+                "season_name": ["2023/2024", "2023/2024"],
+                "team_id": [46, 4172],
+                "last_scraped": [self.NOW - timedelta(hours=1), self.NOW - timedelta(days=60)],
+                "n_players": [30, 30],
+            }
+        )
+        units = prioritize_work_units(
+            self.UNITS, competitions=self.COMPETITIONS, scrape_log=scrape_log, now=self.NOW,
+            weights={"current_season": 0, "tier": 0},
+        )
+        self.assertEqual((46, "2023/2024"), (units["team_id"].iloc[-1], units["season_name"].iloc[-1]))
+
+    def test_prioritize_work_units_prefers_cheaper_units_of_the_same_value(self):
+        scrape_log = pd.DataFrame(
+            {
+                "competition_code": ["IT1", "IT1"],
+                "season_name": ["2023/2024", "2020/2021"],
+                "team_id": [46, 46],
+                "last_scraped": [self.NOW - timedelta(days=60)] * 2,
+                "n_players": [60, 20],
+            }
+        )
+        units = prioritize_work_units(
+            self.UNITS[self.UNITS["team_id"] == 46], scrape_log=scrape_log, now=self.NOW,
+            weights={"current_season": 0},
+        )
+        self.assertEqual(["2020/2021", "2023/2024"], list(units["season_name"]))
+
+    def test_scrape_log_keeps_the_last_scrape_of_every_unit(self):
+        players = self.UNITS.assign(player_id=1)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            scrape_log = ScrapeLog(os.path.join(tmp_dir, "scrape_log.csv"))
+            scrape_log.record(players, scraped_at=self.NOW - timedelta(days=1))
+            scrape_log.record(players.iloc[:1], scraped_at=self.NOW)
+            log = scrape_log.read()
+
+        self.assertEqual(4, log.shape[0])
+        self.assertEqual(self.NOW, log[log["team_id"] == 4172]["last_scraped"].iloc[0])
+        self.assertEqual(2, log[(log["team_id"] == 46)]["n_players"].sum())
+
+        # pages read from the page cache are recorded with the time they were downloaded
+        cached_at = self.NOW - timedelta(days=10)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            scrape_log = ScrapeLog(os.path.join(tmp_dir, "scrape_log.csv"))
+            scrape_log.record(players.iloc[:2], scraped_at={("IT2", "2023/2024", 4172): cached_at})
+            log = scrape_log.read().set_index("team_id")
+
+        self.assertEqual(cached_at, log.loc[4172, "last_scraped"])
+        self.assertGreater(log.loc[46, "last_scraped"], self.NOW)
+
+        # calendar-year seasons, whose names could be read back from the csv as numbers
+        mls_players = pd.DataFrame(
+            {
+                "competition_name": "Major League Soccer",
+                "competition_code": "MLS1",
+                "season_name": "2023",
+                "team_id": 69261,
+                "team_name": "Inter Miami CF",
+                "team_url": "/inter-miami-cf/startseite/verein/69261",
+                "player_id": [28003, 8198],
+            }
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            scrape_log = ScrapeLog(os.path.join(tmp_dir, "scrape_log.csv"))
+            scrape_log.record(mls_players, scraped_at=self.NOW - timedelta(days=60))
+            scrape_log.record(mls_players, scraped_at=self.NOW)
+            mls_log = scrape_log.read()
+        units = prioritize_work_units(mls_players.drop(columns="player_id").iloc[:1], scrape_log=mls_log, now=self.NOW)
+
+        self.assertEqual(1, mls_log.shape[0])
+        self.assertEqual("2023", mls_log["season_name"].iloc[0])
+        self.assertEqual(self.NOW, mls_log["last_scraped"].iloc[0])
+        self.assertEqual(["2023"], list(units["season_name"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
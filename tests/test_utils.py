@@ -1,6 +1,26 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
 from zipfile import ZipFile
 
+import pandas as pd
+import requests_mock
+
 from config.paths import TEST_DATA_DIR
+from src.utils import (
+    PageMemoryLimiter,
+    RESPONSIVE_TABLES,
+    configure_page_fetching,
+    get_page_content,
+    get_page_fetched_at,
+    get_season_names_to_build_urls,
+    normalize_links,
+    open_souped_page,
+    unquote_names,
+)
 
 
 def get_html_text_from_a_test_data_zip_file(file_name):
@@ -8,3 +28,100 @@ def get_html_text_from_a_test_data_zip_file(file_name):
     file_name = zf.open(f"{file_name}.html")
     html_page = file_name.read().decode("utf-8")
     return html_page
+
+
+class TestNormalization(unittest.TestCase):
+    def test_normalize_links_returns_ids_urls_and_saison_ids(self):
+        links = normalize_links(
+            [
+                "/inter-miami-cf/startseite/verein/69261/saison_id/2022",
+                "/lionel-messi/profil/spieler/28003",
+            ]
+        )
+        self.assertEqual([69261, 28003], list(links["id"]))
+        self.assertEqual(
+            ["/inter-miami-cf/startseite/verein/69261", "/lionel-messi/profil/spieler/28003"], list(links["url"])
+        )
+        self.assertEqual("2022", links["saison_id"].iloc[0])
+        self.assertTrue(pd.isna(links["saison_id"].iloc[1]))
+
+    def test_normalize_links_returns_an_empty_data_frame_when_there_are_no_hrefs(self):
+        self.assertEqual(["id", "url", "saison_id"], list(normalize_links([]).columns))
+        self.assertEqual(0, normalize_links([]).shape[0])
+
+    def test_unquote_names_decodes_utf_8_names(self):
+        names = unquote_names(["Mart%C3%ADn", "Mart%C3%ADn", "Lionel Messi"])
+        self.assertEqual(["Martín", "Martín", "Lionel Messi"], list(names))
+
+    def test_get_season_names_to_build_urls_maps_every_distinct_season(self):
+        season_names_for_url = get_season_names_to_build_urls(["2023", "2020/2021", "2023"])
+        self.assertEqual({"2023": "2022", "2020/2021": "2020"}, season_names_for_url)
+
+
+class TestPageCache(unittest.TestCase):
+    URL = "https://www.transfermarkt.com/pisa-sporting-club/startseite/verein/4172/plus/1?saison_id=2020"
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        configure_page_fetching()
+        self.tmp_dir.cleanup()
+
+    def test_get_page_content_downloads_cached_pages_older_than_the_max_cache_age_again(self):
+        configure_page_fetching(cache_dir=self.tmp_dir.name, max_cache_age_hours=24)
+        with requests_mock.Mocker() as m:
+            m.get(self.URL, text="old roster")
+            get_page_content(self.URL)
+            m.get(self.URL, text="new roster")
+            self.assertEqual(b"old roster", get_page_content(self.URL))
+
+            two_days_ago = (datetime.now() - timedelta(days=2)).timestamp()
+            cache_path = os.path.join(self.tmp_dir.name, os.listdir(self.tmp_dir.name)[0])
+            os.utime(cache_path, (two_days_ago, two_days_ago))
+            self.assertEqual(datetime.fromtimestamp(two_days_ago), get_page_fetched_at(self.URL))
+            self.assertEqual(b"new roster", get_page_content(self.URL))
+            n_requests = m.call_count
+
+        self.assertEqual(2, n_requests)
+        self.assertGreater(get_page_fetched_at(self.URL), datetime.fromtimestamp(two_days_ago))
+
+
+class TestPageLifecycle(unittest.TestCase):
+    def test_page_memory_limiter_throttles_the_pages_in_flight(self):
+        limiter = PageMemoryLimiter(max_bytes=10, expected_page_bytes=4)
+
+        def open_page():
+            with limiter.reserve() as reservation:
+                limiter.record_page_size(reservation, 4)
+                time.sleep(0.01)
+
+        threads = [threading.Thread(target=open_page) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(2, limiter.max_pages_in_flight)
+        self.assertEqual(0, limiter.bytes_in_flight)
+
+    def test_page_memory_limiter_lets_a_page_bigger_than_the_ceiling_in(self):
+        limiter = PageMemoryLimiter(max_bytes=10, expected_page_bytes=4)
+        with limiter.reserve() as reservation:
+            limiter.record_page_size(reservation, 100)
+            self.assertEqual(100, limiter.bytes_in_flight)
+        with limiter.reserve():
+            self.assertEqual(1, limiter.pages_in_flight)
+        self.assertEqual(100, limiter.expected_page_bytes)
+        self.assertEqual(0, limiter.bytes_in_flight)
+
+    def test_open_souped_page_only_parses_the_responsive_tables_and_frees_them_on_exit(self):
+        url = "https://www.transfermarkt.com/pisa-sporting-club/startseite/verein/4172/plus/1?saison_id=2020"
+        with requests_mock.Mocker() as m:
+            m.get(url, text=get_html_text_from_a_test_data_zip_file("pisa_2020_page"))
+            with open_souped_page(url, parse_only=RESPONSIVE_TABLES) as souped_page:
+                self.assertIsNone(souped_page.find("h1"))
+                tables = souped_page.find_all("div", {"class": "responsive-table"})
+                self.assertTrue(tables)
+
+        self.assertTrue(souped_page.decomposed)